@@ -17,14 +17,10 @@ client = genai.Client(api_key=api_key)
 async def generate_with_timeout(client, prompt, timeout=10):
     """Generate content with a timeout"""
     try:
-        loop = asyncio.get_event_loop()
         response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None, 
-                lambda: client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=prompt
-                )
+            client.aio.models.generate_content(
+                model="gemini-2.0-flash",
+                contents=prompt
             ),
             timeout=timeout
         )
@@ -4,6 +4,7 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
 from rich import box
+import json
 import math
 import re
 
@@ -69,6 +70,49 @@ def verify(expression: str, expected: float) -> TextContent:
             text=f"Error: {str(e)}"
         )
 
+@mcp.tool()
+def calculate_batch(expressions: list) -> TextContent:
+    """Calculate the results of several expressions in a single call"""
+    console.print("[blue]FUNCTION CALL:[/blue] calculate_batch()")
+    results = []
+    for expression in expressions:
+        console.print(f"[blue]Expression:[/blue] {expression}")
+        try:
+            value = eval(expression)
+            console.print(f"[green]Result:[/green] {value}")
+            results.append({"expr": expression, "value": value})
+        except Exception as e:
+            console.print(f"[red]Error:[/red] {str(e)}")
+            results.append({"expr": expression, "error": str(e)})
+    return TextContent(
+        type="text",
+        text=json.dumps(results)
+    )
+
+@mcp.tool()
+def verify_batch(checks: list) -> TextContent:
+    """Verify several calculations given as {"expression": ..., "expected": ...} items"""
+    console.print("[blue]FUNCTION CALL:[/blue] verify_batch()")
+    results = []
+    for check in checks:
+        try:
+            expression, expected = check["expression"], check["expected"]
+            console.print(f"[blue]Verifying:[/blue] {expression} = {expected}")
+            actual = float(eval(expression))
+            is_correct = abs(actual - float(expected)) < 1e-10
+            if is_correct:
+                console.print(f"[green]✓ Correct! {expression} = {expected}[/green]")
+            else:
+                console.print(f"[red]✗ Incorrect! {expression} should be {actual}, got {expected}[/red]")
+            results.append(is_correct)
+        except Exception as e:
+            console.print(f"[red]Error:[/red] {str(e)}")
+            results.append(False)
+    return TextContent(
+        type="text",
+        text=json.dumps(results)
+    )
+
 @mcp.tool()
 def check_consistency(steps: list) -> TextContent:
     """Check if calculation steps are consistent with each other"""
@@ -1,180 +1,226 @@
+import ast
+import hashlib
+import json
 import os
 import re
+import time
+from pathlib import Path
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 from google import genai
+from google.genai import types
 import asyncio
+from contextlib import AsyncExitStack
 from rich.console import Console
 from rich.panel import Panel
 
 console = Console()
 
+_EXPR_RE = re.compile(r'[\d\s+\-*/()]+')
+
 # Load environment variables and setup Gemini
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 client = genai.Client(api_key=api_key)
 
+# Set LLM_CACHE_PERSIST=1 to reuse replies on disk across runs, as the server does.
+CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST") == "1"
+CACHE_DIR = Path.home() / ".cache" / "gemini-studybuddy"
+CACHE_TTL_SECONDS = 3600
+MODEL = "gemini-2.0-flash"
+
+# One tool-server subprocess and MCP session shared by every main() call in this process.
+_SESSION = None
+_SESSION_LOCK = asyncio.Lock()
+_SESSION_STACK = AsyncExitStack()
+
+def _cache_path(prompt):
+    key = hashlib.sha256(json.dumps({"model": MODEL, "prompt": prompt}, sort_keys=True).encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.txt"
+
+def _is_fresh(cache_path):
+    """Return True if the cached file exists and is younger than CACHE_TTL_SECONDS"""
+    try:
+        return cache_path.stat().st_mtime + CACHE_TTL_SECONDS >= time.time()
+    except OSError:
+        return False
+
+def _parse_trailing_number(step):
+    """Return the number after the last '=' in a step like "23 + 7 = 30", or None"""
+    _, sep, tail = step.rpartition("=")
+    words = tail.split()
+    if not sep or not words:
+        return None
+    try:
+        return float(words[0].rstrip(".,;"))
+    except ValueError:
+        return None
+
+def _parse_plan(result):
+    """Return (paths, decompositions) from the model's JSON plan, falling back to ast.literal_eval but never eval"""
+    try:
+        plan = json.loads(result)
+    except ValueError:
+        snippet = result[result.find("{"):result.rfind("}") + 1]
+        try:
+            plan = json.loads(snippet)
+        except ValueError:
+            plan = ast.literal_eval(snippet)
+
+    paths, decompositions = plan["paths"], plan["decompositions"]
+    if not (isinstance(paths, list) and isinstance(decompositions, list)
+            and all(isinstance(steps, list) for steps in decompositions)):
+        raise ValueError("plan must hold a list of paths and a list of step lists")
+    return paths, decompositions
+
+def _score_path(path):
+    """Score a reasoning path locally with the same toy heuristic as the evaluate_paths tool"""
+    return 100 - len(path) * 5
+
+def _save_reply(prompt, result):
+    """Cache a reply once the caller has parsed it, so a malformed one is never replayed"""
+    if not CACHE_PERSIST:
+        return
+    cache_path = _cache_path(prompt)
+    if not _is_fresh(cache_path):
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(result, encoding="utf-8")
+
 async def generate_with_timeout(client, prompt, timeout=10):
+    """Return the stripped response text, reusing a cached reply for a previously seen prompt"""
+    cache_path = _cache_path(prompt)
+    if CACHE_PERSIST and _is_fresh(cache_path):
+        return cache_path.read_text(encoding="utf-8")
+
     try:
-        loop = asyncio.get_event_loop()
         response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None,
-                lambda: client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=prompt
-                )
+            client.aio.models.generate_content(
+                model=MODEL,
+                contents=prompt,
+                config=types.GenerateContentConfig(response_mime_type="application/json")
             ),
             timeout=timeout
         )
-        return response
     except Exception as e:
         console.print(f"[red]Error: {e}[/red]")
         return None
 
-async def main():
+    if not response.text:
+        return None
+
+    return response.text.strip()
+
+async def get_session():
+    """Return the shared MCP session, spawning cot_tools.py and initializing it on first use"""
+    global _SESSION
+    async with _SESSION_LOCK:
+        if _SESSION is None:
+            server_params = StdioServerParameters(
+                command="python",
+                args=["./tree_search/cot_tools.py"]
+            )
+            read, write = await _SESSION_STACK.enter_async_context(stdio_client(server_params))
+            session = await _SESSION_STACK.enter_async_context(ClientSession(read, write))
+            await session.initialize()
+            _SESSION = session
+    return _SESSION
+
+async def close_session():
+    """Shut down the shared MCP session and its tool server subprocess"""
+    global _SESSION
+    async with _SESSION_LOCK:
+        await _SESSION_STACK.aclose()
+        _SESSION = None
+
+async def main(problem="(23 + 7) * (15 - 8)"):
     try:
         console.print(Panel("Tree Search Reasoning Explorer", border_style="magenta"))
 
-        server_params = StdioServerParameters(
-            command="python",
-            args=["./tree_search/cot_tools.py"]
-        )
-
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
+        session = await get_session()
 
-                system_prompt = """You are a planning agent that explores multiple reasoning paths before solving a problem.
-You have access to these tools:
+        system_prompt = """You are a planning agent that explores multiple reasoning paths before solving a problem.
+Your plan will be executed with these tools:
 - explore_path(steps: list) - Show the reasoning steps for one path
 - calculate(expression: str) - Calculate the result of an expression
 - verify(expression: str, expected: float) - Verify if a calculation is correct
-- evaluate_paths(paths: list) - Evaluate reasoning paths and recommend the best one
 
 First, generate 3 different reasoning paths for solving the problem.
-Then explore the most promising one in steps using function calls.
-
-Respond with EXACTLY ONE line in one of these formats:
-1. FUNCTION_CALL: function_name|param1|param2|...
-2. FINAL_ANSWER: [answer]
-(For evaluate_paths, use FUNCTION_CALL: evaluate_paths|[\"Path 1\", \"Path 2\", \"Path 3\"])"""
-
-                problem = "(23 + 7) * (15 - 8)"
-                console.print(Panel(f"Problem: {problem}", border_style="cyan"))
-
-                prompt = f"{system_prompt}\n\nGenerate 3 different paths for solving: {problem}"
-
-                response = await generate_with_timeout(client, prompt)
-                if not response or not response.text:
-                    return
-
-                result = response.text.strip()
-                console.print(f"\n[yellow]Assistant:[/yellow] {result}")
-
-                match = re.search(r'FUNCTION_CALL:\s*(\w+)\|(.+)', result)
-                if not match:
-                    console.print("[red]No FUNCTION_CALL found in model response[/red]")
-                    return
-
-                func_name = match.group(1)
-                raw_args = match.group(2)
-
-                if func_name == "explore_path":
-                    path_list = eval(raw_args)
-                    await session.call_tool("explore_path", arguments={"steps": path_list})
-                    chosen_path = await session.call_tool("evaluate_paths", arguments={"paths": path_list})
-                elif func_name == "evaluate_paths":
-                    path_list = eval(raw_args)
-                    await session.call_tool("explore_path", arguments={"steps": path_list})
-                    chosen_path = await session.call_tool("evaluate_paths", arguments={"paths": path_list})
-                else:
-                    console.print(f"[red]Unknown function call: {func_name}[/red]")
-                    return
-
-                if not chosen_path or not chosen_path.content:
-                    console.print("[red]No content returned from evaluate_paths[/red]")
-                    return
-
-                content_text = chosen_path.content[0].text.strip()
-                console.print(f"[bold green]Best Path Returned by Tool:[/bold green] {content_text}")
-
-                match = re.search(r'Path (\d+)', content_text)
-                if not match:
-                    console.print("[red]Could not extract best path index from tool output[/red]")
-                    return
-
-                best_path_index = int(match.group(1)) - 1
-                chosen_path_text = path_list[best_path_index]
-
-                console.print(f"\n[yellow]Assistant:[/yellow] Decomposing: {chosen_path_text}")
-                decompose_prompt = (
-                    f"Decompose this into step-by-step calculations: {chosen_path_text} for problem: {problem}.\n"
-                    "Respond in format: FUNCTION_CALL: show_reasoning|[\"step 1\", \"step 2\", ...]"
-                )
-                response = await generate_with_timeout(client, decompose_prompt)
-                if not response or not response.text:
-                    return
-
-                result = response.text.strip()
-                console.print(f"[yellow]Decomposition Response:[/yellow] {result}")
-
-                lines = result.splitlines()
-                steps = []
-
-                for line in lines:
-                    if "show_reasoning|" in line:
-                        try:
-                            part = line.split("show_reasoning|", 1)[1].strip()
-                            extracted_steps = eval(part)
-                            steps.extend(extracted_steps)
-                        except Exception as e:
-                            console.print(f"[red]Failed to parse step line: {line} — {e}[/red]")
-                    elif "[" in line and "]" in line and any(op in line for op in ["+", "-", "*", "/"]):
-                        try:
-                            extracted = eval(line.split("|", 1)[1].strip()) if "|" in line else eval(line.strip())
-                            if isinstance(extracted, list):
-                                steps.extend(extracted)
-                        except Exception as e:
-                            console.print(f"[red]Fallback parse failed: {line} — {e}[/red]")
-                    elif re.match(r'\s*\d+\s*[+\-*/]\s*\d+\s*=\s*\d+', line):
-                        steps.append(line.strip())
-
-                if steps:
-                    await session.call_tool("show_reasoning", arguments={"steps": steps})
-                    console.print(f"[blue]Steps to execute:[/blue] {steps}")
-
-                    for step in steps:
-                        match = re.search(r'([\d\s\+\-\*/\(\)]+)', step)
-                        if match:
-                            expr = match.group(1).strip()
-                            calc = await session.call_tool("calculate", arguments={"expression": expr})
-                            if calc and calc.content:
-                                value_text = calc.content[0].text.strip()
-                                match = re.search(r'(-?\d+(\.\d+)?)', value_text)
-                                if match:
-                                    value = float(match.group(1))
-                                    await session.call_tool("verify", arguments={"expression": expr, "expected": value})
-                                else:
-                                    console.print(f"[red]Could not extract a numeric value from:[/red] {value_text}")
-
-
-                    # ✅ FINAL_ANSWER extraction
-                    final_step = steps[-1].strip()
-                    match = re.search(r'=\s*(\d+(\.\d+)?)', final_step)
-                    if match:
-                        final_answer = match.group(1)
-                        console.print(f"\n[bold cyan]FINAL_ANSWER: {final_answer}[/bold cyan]")
-
-                    console.print("[green]Best path executed successfully![/green]")
-                    console.print("[bold green]🎉 All reasoning steps executed and verified successfully![/bold green]")
-
-                else:
-                    console.print("[red]No valid steps extracted from decomposition response.[/red]")
+Then decompose every path into step-by-step calculations such as "23 + 7 = 30".
+
+Respond with ONLY one JSON object in this format, without markdown or commentary:
+{"paths": ["Path 1", "Path 2", "Path 3"], "decompositions": [["step 1", "step 2", ...], [...], [...]]}
+The i-th entry of "decompositions" must hold the steps of the i-th path."""
+
+        console.print(Panel(f"Problem: {problem}", border_style="cyan"))
+
+        prompt = f"{system_prompt}\n\nGenerate 3 different paths for solving: {problem}"
+
+        result = await generate_with_timeout(client, prompt)
+        if not result:
+            return
+
+        console.print(f"\n[yellow]Assistant:[/yellow] {result}")
+
+        try:
+            path_list, decompositions = _parse_plan(result)
+        except (ValueError, KeyError, TypeError, SyntaxError) as e:
+            console.print(f"[red]Could not parse the plan from model response — {e}[/red]")
+            # Drop a bad cached copy so the next run asks Gemini again.
+            _cache_path(prompt).unlink(missing_ok=True)
+            return
+        _save_reply(prompt, result)
+
+        await session.call_tool("explore_path", arguments={"steps": path_list})
+        best_path_index = max(range(len(path_list)), key=lambda i: _score_path(path_list[i]))
+        console.print(f"[bold green]Best Path:[/bold green] Path {best_path_index + 1}")
+        chosen_path_text = path_list[best_path_index]
+
+        console.print(f"\n[yellow]Assistant:[/yellow] Decomposing: {chosen_path_text}")
+
+        steps = []
+        if best_path_index < len(decompositions):
+            steps = [str(step).strip() for step in decompositions[best_path_index]]
+
+        if steps:
+            await session.call_tool("show_reasoning", arguments={"steps": steps})
+            console.print(f"[blue]Steps to execute:[/blue] {steps}")
+
+            matches = (_EXPR_RE.search(step) for step in steps)
+            exprs = [match.group(0).strip() for match in matches if match and match.group(0).strip()]
+            calc = await session.call_tool("calculate_batch", arguments={"expressions": exprs})
+            if calc and calc.content:
+                checks = []
+                for item in json.loads(calc.content[0].text):
+                    if "value" in item:
+                        checks.append({"expression": item["expr"], "expected": float(item["value"])})
+                    else:
+                        console.print(f"[red]Could not calculate:[/red] {item['expr']} — {item.get('error')}")
+                if checks:
+                    await session.call_tool("verify_batch", arguments={"checks": checks})
+
+            # ✅ FINAL_ANSWER extraction
+            final_answer = _parse_trailing_number(steps[-1])
+            if final_answer is not None:
+                shown = int(final_answer) if final_answer.is_integer() else repr(final_answer)
+                console.print(f"\n[bold cyan]FINAL_ANSWER: {shown}[/bold cyan]")
+
+            console.print("[green]Best path executed successfully![/green]")
+            console.print("[bold green]🎉 All reasoning steps executed and verified successfully![/bold green]")
+
+        else:
+            console.print("[red]No valid steps extracted from decomposition response.[/red]")
 
     except Exception as e:
         console.print(f"[red]Error: {e}[/red]")
 
+async def run(problems):
+    """Solve each problem in turn over one MCP session instead of spawning a server per problem"""
+    try:
+        for problem in problems:
+            await main(problem)
+    finally:
+        await close_session()
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(run(["(23 + 7) * (15 - 8)"]))
\ No newline at end of file
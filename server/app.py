@@ -1,60 +1,127 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import re
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Callable, Dict, List, TypeVar
 
+import httpx
+import orjson
 from google import genai
+from google.genai.types import GenerateContentConfig, GenerateContentResponse, HttpOptions
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from starlette.concurrency import run_in_threadpool
+
+from coalescer import RequestCoalescer
+from compression import SelectiveGZipMiddleware
+from llm_cache import DEFAULT_CACHE_DIR, LLMCache, cache_key
+from log_writer import LogWriter
+from rate_limit import RateLimiter
 
 load_dotenv()
 
-app = FastAPI(title="Gemini Study Buddy API", version="0.3.0")
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Checked at startup rather than import, so the module stays importable without a key.
+    if not api_key:
+        raise RuntimeError("Gemini API key missing. Set GEMINI_API_KEY in the environment or server/.env.")
+    await LOG_WRITER.start()
+    yield
+    await _close_clients()
+    await LOG_WRITER.aclose()
+
+
+app = FastAPI(
+    title="Gemini Study Buddy API",
+    version="0.3.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Only the extension popup calls the API; Chrome extension IDs are 32 letters a-p.
+# Preflights are cached for 2 hours, the most Chrome honours.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origin_regex=os.getenv("CORS_ALLOW_ORIGIN_REGEX", r"chrome-extension://[a-p]{32}"),
     allow_credentials=False,
     allow_methods=["POST", "GET", "OPTIONS"],
-    allow_headers=["*"]
+    allow_headers=["content-type"],
+    max_age=7200,
 )
+# Compress /generate bodies over 1 KiB; the SSE stream is left alone so events are not held back.
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=5, exclude_paths=("/generate/stream",))
 
 DEFAULT_MODEL = "gemini-2.0-flash"
 FLASHCARD_COUNT = 5
 LOG_PATH = Path(__file__).resolve().parent / "logs" / f"agent_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 LOG_LINE_WIDTH = 72
+LOG_WRITER = LogWriter(LOG_PATH)
+
+# Set LLM_CACHE_PERSIST=1 to keep cached Gemini responses on disk across restarts.
+LLM_CACHE = LLMCache(cache_dir=DEFAULT_CACHE_DIR if os.getenv("LLM_CACHE_PERSIST") == "1" else None)
+GEMINI_COALESCER = RequestCoalescer()
+# Bounds in-flight Gemini calls and their start rate so bursts queue here instead of hitting 429s.
+GEMINI_LIMITER = RateLimiter(
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")),
+    rate=float(os.getenv("GEMINI_RPM", "60")),
+)
+# Finished /generate payloads (serialized JSON), so repeated pages skip the pipeline entirely.
+RESPONSE_CACHE = LLMCache(maxsize=1024, ttl=600.0)
+# "combined" asks for rating, hierarchy and cards in one call, "parallel" runs the three tools
+# concurrently, and "agent" lets Gemini drive the tools one round-trip at a time.
+PIPELINE = os.getenv("STUDY_BUDDY_PIPELINE", "combined")
+
+# Resolved once; a stray newline or space from .env would otherwise fail every Gemini call.
+api_key = (os.getenv("GEMINI_API_KEY") or "").strip() or None
+
+# Static instructions for the combined pipeline, sent as system_instruction so the
+# per-request contents are only the learner material.
+STUDY_PACK_INSTRUCTIONS = (
+    "You are helping a learner revise the material they send.\n"
+    "Respond ONLY with one JSON object containing:\n"
+    "  - \"content_rating\": an integer 1-10 for how useful the text is for durable knowledge "
+    "(1-4 time-bound news, 5-7 some explanation, 8-10 clear concepts, mechanisms, procedures).\n"
+    "  - \"information_hierarchy\": a brief plain-text concept tree (<= 3 levels, indented with dashes) "
+    "ending with the line \"Note about job function: <job1>, <job2>\".\n"
+    "  - \"cards\": an array of up to {flashcard_count} flashcards, each with \"front\" "
+    "(a short active-recall question, <= 120 chars) and \"back\" (the concise answer, <= 240 chars).\n"
+    "Do not add commentary before or after the JSON."
+).format(flashcard_count=FLASHCARD_COUNT)
+
+AGENT_SYSTEM_PROMPT = """You are a learning-assistant agent preparing flashcards in iterations.
+Your goal: help the learner deeply grasp content meaningfully.
 
-api_key = os.getenv("GEMINI_API_KEY")
+Respond with EXACTLY ONE of these two formats:
+1. FUNCTION_CALL: <python_function_name>|<input_text>
+2. FINAL_ANSWER: <json_array>
 
-if not api_key:
-    raise HTTPException(
-        status_code=400,
-        detail="Gemini API key missing. Provide it in the request or set GEMINI_API_KEY.",
-    )
+The python_function_name MUST be one of and follow the sequence:
+- rate_content_quality
+- infer_information_hierarchy_and_jobs_simple
+- generate_flashcards_json
 
-SUMMARY_PROMPT_TEMPLATE = (
-    "Extract the essential study notes from the learner material below. "
-    "Focus on crisp facts, definitions, formulas, and conceptual explanations.\n"
-    "Learner material:\n{page_text}"
-)
+Rules:
+- Do NOT add any text, explanations, or markdown.
+- Output MUST begin with FUNCTION_CALL: or FINAL_ANSWER: as the very first characters (no spaces, no newlines).
+- Never include multiple responses or commentary.
 
-FLASHCARD_PROMPT_TEMPLATE = (
-    "You are helping a learner revise.\n"
-    "Create up to {flashcard_count} high-quality flashcards using the study summary below.\n"
-    "Respond ONLY with a JSON array. Each item must contain:\n"
-    "  - \"front\": a short active-recall question or prompt (<= 120 chars).\n"
-    "  - \"back\": the concise answer or explanation (<= 240 chars).\n"
-    "Do not add commentary before or after the JSON.\n\n"
-    "Study summary:\n{study_summary}"
-)
+Example valid responses:
+FUNCTION_CALL: rate_content_quality|....
+FINAL_ANSWER: [{"front":"What is AI?","back":"AI is..."}]
+
+Let's solve this step by step.
+"""
+_AGENT_PROMPT_PREFIX = f"{AGENT_SYSTEM_PROMPT}\n\nQuery: web page content - "
 
 
 class PageContext(BaseModel):
@@ -72,9 +139,54 @@ class Flashcard(BaseModel):
     back: str
 
 
+class StudyPack(BaseModel):
+    content_rating: int
+    information_hierarchy: str
+    cards: list[Flashcard]
+
+
+# Constrain the combined reply to StudyPack's JSON shape instead of relying on prompt wording alone.
+STUDY_PACK_CONFIG = GenerateContentConfig(
+    system_instruction=STUDY_PACK_INSTRUCTIONS,
+    response_mime_type="application/json",
+    response_schema=StudyPack,
+)
+
+
+def _config_fingerprint(config: GenerateContentConfig) -> str:
+    """Digest the config fields that shape a reply, so changing them invalidates cached replies."""
+    schema = config.response_schema
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        schema = schema.model_json_schema()
+    payload = {
+        "system_instruction": config.system_instruction,
+        "response_mime_type": config.response_mime_type,
+        "response_schema": schema,
+    }
+    return hashlib.sha256(orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+# Computed once; STUDY_PACK_CONFIG is the only config on the hot path.
+_STUDY_PACK_CONFIG_KEY = _config_fingerprint(STUDY_PACK_CONFIG)
+
+
+def _reply_key(model_name: str, prompt: str, config: GenerateContentConfig | None) -> str:
+    if config is None:
+        config_key = ""
+    elif config is STUDY_PACK_CONFIG:
+        config_key = _STUDY_PACK_CONFIG_KEY
+    else:
+        config_key = _config_fingerprint(config)
+    return cache_key(model_name, prompt, config_key)
+
+
+_STEPS_OK = ("Flashcards generated successfully.",)
+
+
 class GenerateResponse(BaseModel):
     cards: dict[str, Flashcard]
-    steps: list[str]
+    # High-level progress text for the UI; every successful response reports the same steps.
+    steps: tuple[str, ...] = _STEPS_OK
     content_rating: int | None = None
     information_hierarchy: str | None = None
 
@@ -83,74 +195,306 @@ class ErrorResponse(BaseModel):
     detail: str
 
 
-def _log_lines(lines: list[str], *, header: bool = False) -> None:
-    """Append formatted lines to the request log."""
-    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with LOG_PATH.open("a", encoding="utf-8") as log_file:
-        if header:
-            separator = "=" * LOG_LINE_WIDTH
-            log_file.write(f"\n{separator}\n")
-        for line in lines:
-            log_file.write(f"{line}\n")
-        if header:
-            log_file.write("=" * LOG_LINE_WIDTH + "\n")
+_LOG_SEPARATOR = "=" * LOG_LINE_WIDTH
+_LOG_TITLE = f"{'Gemini Study Buddy Request':^{LOG_LINE_WIDTH}}"
+
+
+def _response_cache_key(model_name: str, request_text: str) -> str:
+    # Case and whitespace differences should not defeat the cache for the same page.
+    normalized = " ".join(request_text.lower().split())
+    # Hash the small prefix and the page body separately rather than concatenating and
+    # JSON-encoding another full copy of the text, as cache_key would.
+    digest = hashlib.sha256(f"{model_name}|{PIPELINE}|{FLASHCARD_COUNT}|".encode("utf-8"))
+    digest.update(normalized.encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Whole-second prefix of the last timestamp, reused until the wall-clock second changes.
+_STAMP_SECOND = -1
+_STAMP_PREFIX = ""
+
+
+def _timestamp() -> str:
+    """Return the local time in isoformat with microseconds, formatting the date part once per second."""
+    global _STAMP_SECOND, _STAMP_PREFIX
+    second, nanos = divmod(time.time_ns(), 1_000_000_000)
+    if second != _STAMP_SECOND:
+        _STAMP_PREFIX = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second))
+        _STAMP_SECOND = second
+    return f"{_STAMP_PREFIX}.{nanos // 1000:06d}"
+
+
+def _log_request(started: str, status: str) -> None:
+    """Queue one request's header block and final status as a single string."""
+    LOG_WRITER.put(f"\n{_LOG_SEPARATOR}\n{_LOG_TITLE}\nStarted: {started}\n{_LOG_SEPARATOR}\n{status}\n")
+
+
+# Keep Gemini connections warm so concurrent requests reuse TLS sessions instead of re-handshaking.
+GEMINI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=300)
+GEMINI_TRANSPORT_RETRIES = 2
+
+
+def _http_options() -> HttpOptions:
+    # Passing explicit transports also keeps the async client on httpx rather than aiohttp.
+    # HTTP/2 lets concurrent calls share one connection as multiplexed streams.
+    transport_args = {"limits": GEMINI_HTTP_LIMITS, "retries": GEMINI_TRANSPORT_RETRIES, "http2": True}
+    return HttpOptions(
+        client_args={"transport": httpx.HTTPTransport(**transport_args)},
+        async_client_args={"transport": httpx.AsyncHTTPTransport(**transport_args)},
+    )
+
+
+# Clients keyed by a digest of their API key, so raw keys are never held as dict keys.
+# Only touched from the event loop, which never switches tasks mid-lookup, so no lock is needed.
+_CLIENTS: dict[str, genai.Client] = {}
 
 
-@lru_cache(maxsize=4)
 def _get_client(api_key: str) -> genai.Client:
-    return genai.Client(api_key=api_key)
+    """Return the process-wide client for `api_key`, creating it on first use."""
+    key = hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).hexdigest()
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = _CLIENTS[key] = genai.Client(api_key=api_key, http_options=_http_options())
+    return client
+
+
+async def _close_clients() -> None:
+    """Release the HTTP connection pools of every cached client on shutdown."""
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    for client in clients:
+        client.close()
+        await client.aio.aclose()
+
+
+T = TypeVar("T")
+
+
+def _identity(text: str) -> str:
+    return text
+
+
+async def _generate_text(
+    client: genai.Client,
+    model_name: str,
+    prompt: str,
+    config: GenerateContentConfig | None = None,
+    parse: Callable[[str], T] = _identity,
+) -> T:
+    """Return `parse` applied to Gemini's reply to `prompt`, reusing a cached reply for identical prompts.
+
+    `parse` raises ValueError for a reply the caller cannot use; such replies are never cached.
+    """
+    key = _reply_key(model_name, prompt, config)
+    cached = await LLM_CACHE.get(key)
+    if cached is not None:
+        try:
+            return parse(cached)
+        except ValueError:
+            # Left by an older parser version; ask Gemini again and overwrite it.
+            pass
+
+    # Concurrent requests for the same prompt wait on a single Gemini call.
+    return await GEMINI_COALESCER.submit(key, lambda: _fetch_text(client, model_name, prompt, key, config, parse))
+
+
+async def _fetch_text(
+    client: genai.Client,
+    model_name: str,
+    prompt: str,
+    key: str,
+    config: GenerateContentConfig | None,
+    parse: Callable[[str], T],
+) -> T:
+    async with GEMINI_LIMITER:
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=config,
+        )
+
+    # The single point where reply text is stripped; callers use it as-is.
+    response_text = _extract_text(response).strip()
+    parsed = parse(response_text)
+    if response_text:
+        await LLM_CACHE.set(key, response_text)
+    return parsed
+
+
+async def _stream_text(
+    client: genai.Client,
+    model_name: str,
+    prompt: str,
+    config: GenerateContentConfig | None = None,
+    validate: Callable[[str], object] = _identity,
+) -> AsyncIterator[str]:
+    """Yield Gemini's reply to `prompt` as it arrives, serving and filling the reply cache.
+
+    The full reply is cached only if `validate` accepts it; otherwise its ValueError propagates.
+    """
+    key = _reply_key(model_name, prompt, config)
+    cached = await LLM_CACHE.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    pieces: list[str] = []
+    async with GEMINI_LIMITER:
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=prompt,
+            config=config,
+        )
+        async for chunk in stream:
+            piece = _extract_text(chunk)
+            if piece:
+                pieces.append(piece)
+                yield piece
+
+    response_text = "".join(pieces).strip()
+    validate(response_text)
+    if response_text:
+        await LLM_CACHE.set(key, response_text)
+
+
+# Matches a whole reply wrapped in a ``` fence, with an optional json language tag.
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
 
 
 def _strip_code_fences(text: str) -> str:
-    candidate = text.strip()
-    if candidate.startswith("```") and candidate.endswith("```"):
-        candidate = candidate[3:-3].strip()
-        if candidate.lower().startswith("json"):
-            candidate = candidate[4:].strip()
-    return candidate
-
-
-def _extract_text(response: Any) -> str:
-    text = getattr(response, "text", None)
-    if text:
-        return str(text).strip()
-
-    candidates = getattr(response, "candidates", None)
-    if candidates is None and isinstance(response, dict):
-        candidates = response.get("candidates")
-
-    collected: list[str] = []
-    if candidates:
-        for candidate in candidates:
-            content = getattr(candidate, "content", None)
-            if content is None and isinstance(candidate, dict):
-                content = candidate.get("content")
-
-            parts = getattr(content, "parts", None) if content is not None else None
-            if parts is None and isinstance(content, dict):
-                parts = content.get("parts")
-
-            if not parts:
-                continue
+    """Remove a surrounding ``` fence from `text`, which the caller has already stripped."""
+    match = _FENCE_RE.fullmatch(text)
+    return match.group(1) if match else text
 
-            for part in parts:
-                part_text = getattr(part, "text", None)
-                if part_text is None and isinstance(part, dict):
-                    part_text = part.get("text")
-                if part_text:
-                    collected.append(str(part_text))
 
-    return "".join(collected).strip()
+def _extract_text(response: GenerateContentResponse) -> str:
+    """Return the concatenated text parts of the first candidate, unstripped."""
+    candidates = response.candidates
+    content = candidates[0].content if candidates else None
+    parts = content.parts if content is not None else None
+    if not parts:
+        return ""
+    # Gemini replies almost always carry a single text part.
+    if len(parts) == 1:
+        return parts[0].text or ""
+    return "".join(part.text for part in parts if part.text)
 
 
-def _parse_flashcards(raw_text: str, max_cards: int) -> list[Flashcard]:
+def _build_agent_prompt(page_text: str, history: str) -> str:
+    """Compose the agent prompt from the page text and the already-joined tool history."""
+    if not history:
+        return f"{_AGENT_PROMPT_PREFIX}{page_text}"
+    return f"{_AGENT_PROMPT_PREFIX}{page_text}\n\n{history}\n\nWhat should I do next?"
+
+
+def _parse_function_call(response_text: str) -> tuple[str, str]:
+    """Split a `FUNCTION_CALL: name|params` reply into its name and params in one pass."""
+    colon = response_text.find(":")
+    pipe = response_text.find("|", colon + 1)
+    if colon == -1 or pipe == -1:
+        raise ValueError("Function call is missing the name|params separator.")
+    return response_text[colon + 1 : pipe].strip(), response_text[pipe + 1 :].strip()
+
+
+def _load_json(raw_text: str) -> Any:
     cleaned = _strip_code_fences(raw_text)
-    parsed: Any
     try:
-        parsed = json.loads(cleaned)
-    except json.JSONDecodeError:
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError:
         raise ValueError("Flashcard response was not valid JSON.")
 
+
+def _parse_flashcards(raw_text: str, max_cards: int) -> list[Flashcard]:
+    return _coerce_flashcards(_load_json(raw_text), max_cards)
+
+
+def _parse_study_pack(raw_text: str, max_cards: int) -> tuple[list[Flashcard], int | None, str | None]:
+    """Split a combined-prompt reply into its flashcards, content rating and hierarchy."""
+    parsed = _load_json(raw_text)
+    if not isinstance(parsed, dict):
+        raise ValueError("Study pack JSON must be an object.")
+
+    try:
+        content_rating = int(parsed.get("content_rating"))
+    except (TypeError, ValueError):
+        content_rating = None
+    if content_rating is not None and not 1 <= content_rating <= 10:
+        content_rating = None
+
+    hierarchy = parsed.get("information_hierarchy")
+    information_hierarchy = str(hierarchy).strip() if hierarchy else None
+    return _coerce_flashcards(parsed.get("cards") or [], max_cards), content_rating, information_hierarchy
+
+
+# Reply parsers for _generate_text/_stream_text: each raises ValueError for a reply that must not be cached.
+
+
+def _parse_study_pack_reply(raw_text: str) -> tuple[list[Flashcard], int | None, str | None]:
+    if not raw_text:
+        raise ValueError("Gemini returned empty flashcard content.")
+    return _parse_study_pack(raw_text, FLASHCARD_COUNT)
+
+
+def _check_flashcards(raw_text: str) -> str:
+    """Return the flashcard reply unchanged once it is known to decode; the agent needs the raw text."""
+    _parse_flashcards(raw_text, FLASHCARD_COUNT)
+    return raw_text
+
+
+def _parse_rating(raw_text: str) -> int:
+    match = re.search(r"\b(10|[1-9])\b", raw_text)
+    if match is None:
+        raise ValueError("Rating reply did not contain an integer from 1 to 10.")
+    return int(match.group(1))
+
+
+def _parse_agent_reply(response_text: str) -> tuple[str, Any]:
+    """Classify an agent reply as ("FUNCTION_CALL", (name, params)) or ("FINAL_ANSWER", flashcards)."""
+    if response_text.startswith("FUNCTION_CALL:"):
+        try:
+            return "FUNCTION_CALL", _parse_function_call(response_text)
+        except ValueError as exc:
+            raise ValueError("Gemini returned an invalid function call.") from exc
+    if response_text.startswith("FINAL_ANSWER:"):
+        final_payload = response_text[len("FINAL_ANSWER:") :].strip()
+        if not final_payload:
+            raise ValueError("Gemini returned empty flashcard content.")
+        return "FINAL_ANSWER", _parse_flashcards(final_payload, FLASHCARD_COUNT)
+    raise ValueError("Gemini response missing FUNCTION_CALL or FINAL_ANSWER prefix.")
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _scan_cards(buffer: str, pos: int) -> tuple[list[Any], int]:
+    """Decode the card objects completed in `buffer` since `pos`.
+
+    Returns the new items and the offset to resume from; `pos` 0 means the
+    "cards" array has not been located yet.
+    """
+    if pos == 0:
+        start = buffer.find('"cards"')
+        bracket = buffer.find("[", start) if start != -1 else -1
+        if bracket == -1:
+            return [], 0
+        pos = bracket + 1
+
+    items: list[Any] = []
+    end = len(buffer)
+    while True:
+        while pos < end and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= end or buffer[pos] == "]":
+            return items, pos
+        try:
+            item, pos = _JSON_DECODER.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The next card is still being generated.
+            return items, pos
+        items.append(item)
+
+
+def _coerce_flashcards(parsed: Any, max_cards: int) -> list[Flashcard]:
     if isinstance(parsed, dict):
         parsed_list = [parsed]
     elif isinstance(parsed, list):
@@ -168,14 +512,15 @@ def _parse_flashcards(raw_text: str, max_cards: int) -> list[Flashcard]:
             continue
         if not back:
             back = front
-        flashcards.append(Flashcard(front=front, back=back))
+        # front/back are already coerced to non-empty strings, so skip re-validation.
+        flashcards.append(Flashcard.model_construct(front=front, back=back))
         if len(flashcards) >= max_cards:
             break
 
     return flashcards
 
 
-def rate_content_quality(
+async def rate_content_quality(
     content: str
 ) -> int:
     """
@@ -205,11 +550,13 @@ def rate_content_quality(
     except Exception as exc:
         raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
     
-    out = client.models.generate_content(model="gemini-2.0-flash",contents=prompt)
-    m = re.search(r"\b(10|[1-9])\b", out.text)
-    return int(m.group(1)) if m else 5
+    try:
+        return await _generate_text(client, "gemini-2.0-flash", prompt, parse=_parse_rating)
+    except ValueError:
+        # Unrated replies are not cached, so the next request asks again.
+        return 5
 
-def generate_flashcards_json(
+async def generate_flashcards_json(
     study_summary: str
 ) -> List[Dict[str, str]]:
     """
@@ -244,10 +591,9 @@ Study summary:
     except Exception as exc:
         raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
     
-    out = client.models.generate_content(model="gemini-2.0-flash",contents=prompt)
-    return out.text
+    return await _generate_text(client, "gemini-2.0-flash", prompt, parse=_check_flashcards)
 
-def infer_information_hierarchy_and_jobs_simple(
+async def infer_information_hierarchy_and_jobs_simple(
     content: str
 ) -> str:
     """
@@ -277,157 +623,202 @@ Text:
     except Exception as exc:
         raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
     
-    out = client.models.generate_content(model="gemini-2.0-flash",contents=prompt)
-    return out.text.strip()
+    return await _generate_text(client, "gemini-2.0-flash", prompt)
 
-def function_caller(func_name, params):
+FUNCTION_MAP = {
+    "rate_content_quality": rate_content_quality,
+    "infer_information_hierarchy_and_jobs_simple": infer_information_hierarchy_and_jobs_simple,
+    "generate_flashcards_json": generate_flashcards_json
+}
+
+async def function_caller(func_name, params):
     """Simple function caller that maps function names to actual functions"""
-    function_map = {
-        "rate_content_quality": rate_content_quality,
-        "infer_information_hierarchy_and_jobs_simple": infer_information_hierarchy_and_jobs_simple,
-        "generate_flashcards_json": generate_flashcards_json
-    }
-    
-    if func_name not in function_map:
+    func = FUNCTION_MAP.get(func_name)
+    if func is None:
         raise ValueError(f"Function {func_name} not found")
 
-    return function_map[func_name](params)
+    return await func(params)
 
-@app.get("/health", response_model=dict[str, str])
-async def health() -> dict[str, str]:
-    return {"status": "ok"}
-
-
-@app.post(
-    "/generate",
-    response_model=GenerateResponse,
-    responses={400: {"model": ErrorResponse}, 502: {"model": ErrorResponse}},
-)
-async def generate(request: GenerateRequest) -> GenerateResponse:
-    # Capture a trimmed version of the learner content to keep logs readable.
-    page_context = request.page_context
-    request_text = page_context.text.strip()
 
-    # Log a header so each request is easy to spot in the rolling agent history file.
-    _log_lines(
-        [
-            f"{'Gemini Study Buddy Request':^{LOG_LINE_WIDTH}}",
-            f"Started: {datetime.now().isoformat()}",
-        ],
-        header=True,
-    )
+async def _run_agent(
+    client: genai.Client, model_name: str, request_text: str
+) -> tuple[list[Flashcard], int | None, str | None]:
+    """Drive the FUNCTION_CALL/FINAL_ANSWER agent loop, one Gemini round-trip per tool."""
+    # One call per tool plus the FINAL_ANSWER turn.
+    max_iterations = len(FUNCTION_MAP) + 1
+    iteration = 0
+    flashcards: list[Flashcard] | None = None
+    content_rating: int | None = None
+    information_hierarchy: str | None = None
+    history_joined = ""
+
+    while iteration < max_iterations:
+        prompt = _build_agent_prompt(request_text, history_joined)
+        try:
+            kind, reply = await _generate_text(client, model_name, prompt, parse=_parse_agent_reply)
+        except ValueError as exc:
+            raise HTTPException(status_code=502, detail=str(exc)) from exc
+
+        if kind == "FUNCTION_CALL":
+            func_name, params = reply
+            try:
+                iteration_result = await function_caller(func_name, params)
+            except Exception as exc:
+                raise HTTPException(status_code=502, detail=f"Function {func_name} failed: {exc}") from exc
+
+            if func_name == "rate_content_quality":
+                try:
+                    content_rating = int(iteration_result)
+                except (TypeError, ValueError):
+                    content_rating = None
+            elif func_name == "infer_information_hierarchy_and_jobs_simple":
+                information_hierarchy = iteration_result
+
+            # The params are normally the page text, which every prompt already carries; echoing
+            # them here would add another copy of the page per iteration.
+            history_entry = (
+                f"In the {iteration + 1} iteration you called {func_name}, and the function returned {iteration_result}."
+            )
+            history_joined = f"{history_joined} {history_entry}" if history_joined else history_entry
+            iteration += 1
+            continue
 
+        flashcards = reply
+        break
 
+    if flashcards is None:
+        raise HTTPException(status_code=502, detail="Gemini agent did not produce a final answer.")
+    return flashcards, content_rating, information_hierarchy
 
-    model_name = DEFAULT_MODEL
 
+async def _run_combined(
+    client: genai.Client, model_name: str, request_text: str
+) -> tuple[list[Flashcard], int | None, str | None]:
+    """Get the rating, hierarchy and flashcards from a single Gemini request."""
+    prompt = f"Learner material:\n{request_text}"
     try:
-        client = _get_client(api_key)
-    except Exception as exc:
-        raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
-
-    # `steps` is returned to the client so the UI can display high-level progress.
-    steps: list[str] = []
-    cards: dict[str, Flashcard] = {}
+        return await _generate_text(client, model_name, prompt, STUDY_PACK_CONFIG, parse=_parse_study_pack_reply)
+    except ValueError as exc:
+        raise HTTPException(status_code=502, detail=str(exc)) from exc
+
+
+async def _run_parallel(
+    client: genai.Client, model_name: str, request_text: str
+) -> tuple[list[Flashcard], int | None, str | None]:
+    """Run the three tools concurrently; none of them depends on another's output."""
+    content_rating, information_hierarchy, raw_cards = await asyncio.gather(
+        rate_content_quality(request_text),
+        infer_information_hierarchy_and_jobs_simple(request_text),
+        generate_flashcards_json(request_text),
+        return_exceptions=True,
+    )
+    # Only the flashcards are essential; a failed rating or hierarchy is reported as missing.
+    if isinstance(raw_cards, HTTPException):
+        raise raw_cards
+    if isinstance(raw_cards, BaseException):
+        raise HTTPException(status_code=502, detail=f"Gemini tool call failed: {raw_cards}") from raw_cards
+    if isinstance(content_rating, BaseException):
+        content_rating = None
+    if isinstance(information_hierarchy, BaseException):
+        information_hierarchy = None
 
     try:
-        max_iterations = 4
-        iteration = 0
-        iteration_response: list[str] = []
-        flashcards: list[Flashcard] | None = None
-        content_rating: int | None = None
-        information_hierarchy: str | None = None
-
-        system_prompt = """You are a learning-assistant agent preparing flashcards in iterations.
-Your goal: help the learner deeply grasp content meaningfully.
-
-Respond with EXACTLY ONE of these two formats:
-1. FUNCTION_CALL: <python_function_name>|<input_text>
-2. FINAL_ANSWER: <json_array>
-
-The python_function_name MUST be one of and follow the sequence:
-- rate_content_quality
-- infer_information_hierarchy_and_jobs_simple
-- generate_flashcards_json
+        flashcards = _parse_flashcards(raw_cards, FLASHCARD_COUNT)
+    except ValueError as exc:
+        raise HTTPException(status_code=502, detail=str(exc)) from exc
+    return flashcards, content_rating, information_hierarchy
+
+
+PIPELINES = {
+    "combined": _run_combined,
+    "parallel": _run_parallel,
+    "agent": _run_agent,
+}
+if PIPELINE not in PIPELINES:
+    raise RuntimeError(f"STUDY_BUDDY_PIPELINE must be one of {', '.join(PIPELINES)}, not {PIPELINE!r}")
+# Resolved once: STUDY_BUDDY_PIPELINE is read at import, so the choice never changes per request.
+RUN_PIPELINE = PIPELINES[PIPELINE]
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def _stream_study_pack(client: genai.Client, model_name: str, request_text: str) -> AsyncIterator[str]:
+    """Emit a `card` event per flashcard as Gemini writes it, then a `done` event with the full response."""
+    started = _timestamp()
+    prompt = f"Learner material:\n{request_text}"
+    buffer = ""
+    pos = 0
+    sent = 0
+    try:
+        async for piece in _stream_text(client, model_name, prompt, STUDY_PACK_CONFIG, _parse_study_pack_reply):
+            buffer += piece
+            if sent >= FLASHCARD_COUNT:
+                continue
+            items, pos = _scan_cards(buffer, pos)
+            for card in _coerce_flashcards(items, FLASHCARD_COUNT - sent):
+                sent += 1
+                yield _sse("card", card.model_dump_json())
 
-Rules:
-- Do NOT add any text, explanations, or markdown.
-- Output MUST begin with FUNCTION_CALL: or FINAL_ANSWER: as the very first characters (no spaces, no newlines).
-- Never include multiple responses or commentary.
+        flashcards, content_rating, information_hierarchy = _parse_study_pack(buffer.strip(), FLASHCARD_COUNT)
+        response_payload = GenerateResponse(
+            cards={f"card_{index}": card for index, card in enumerate(flashcards, start=1)},
+            content_rating=content_rating,
+            information_hierarchy=information_hierarchy,
+        )
+        _log_request(started, "Status: Flashcards streamed successfully.")
+        yield _sse("done", response_payload.model_dump_json())
+    except Exception as exc:
+        # Headers are already sent, so failures are reported in-band instead of as a status code.
+        _log_request(started, f"Status: Stream failed: {exc}")
+        yield _sse("error", orjson.dumps({"detail": f"Gemini request failed: {exc}"}).decode())
 
-Example valid responses:
-FUNCTION_CALL: rate_content_quality|....
-FINAL_ANSWER: [{"front":"What is AI?","back":"AI is..."}]
 
-Let's solve this step by step.
-"""
+# Built once: CORS copies the header list before adding to it, and the body is below the gzip threshold.
+_HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
 
-        base_query = request_text
-        current_query = base_query
 
-        while iteration < max_iterations:
-            print(f"\n--- Iteration {iteration + 1} ---")
+@app.get("/health", response_model=None)
+async def health() -> Response:
+    return _HEALTH_RESPONSE
 
-            prompt = f"{system_prompt}\n\nQuery: web page content - {current_query}"
-            response = await run_in_threadpool(
-                client.models.generate_content,
-                model=model_name,
-                contents=prompt,
-            )
 
-            response_text = (response.text or "").strip()
-            
+@app.post(
+    "/generate",
+    # The handler returns pre-serialized JSON; GenerateResponse is kept only for the OpenAPI schema.
+    response_model=None,
+    responses={
+        200: {"model": GenerateResponse},
+        400: {"model": ErrorResponse},
+        502: {"model": ErrorResponse},
+    },
+)
+async def generate(request: GenerateRequest) -> Response:
+    # Capture a trimmed version of the learner content to keep logs readable.
+    page_context = request.page_context
+    request_text = page_context.text.strip()
 
-            if response_text.startswith("FUNCTION_CALL:"):
-                try:
-                    _, function_info = response_text.split(":", 1)
-                    func_name, params = [x.strip() for x in function_info.split("|", 1)]
-                    print(f"LLM Response: FUNCTION_CALL: {func_name} ")
-                except ValueError as exc:
-                    raise HTTPException(status_code=502, detail="Gemini returned an invalid function call.") from exc
+    # Each request gets a header block so it is easy to spot in the rolling agent history file.
+    started = _timestamp()
 
-                try:
-                    iteration_result = await run_in_threadpool(function_caller, func_name, params)
-                    print(f"Results :{iteration_result} ")
-                except Exception as exc:
-                    raise HTTPException(status_code=502, detail=f"Function {func_name} failed: {exc}") from exc
-
-                if func_name == "rate_content_quality":
-                    try:
-                        content_rating = int(iteration_result)
-                    except (TypeError, ValueError):
-                        content_rating = None
-                elif func_name == "infer_information_hierarchy_and_jobs_simple":
-                    information_hierarchy = str(iteration_result).strip()
-
-                iteration_response.append(
-                    f"In the {iteration + 1} iteration you called {func_name} with {params} parameters, and the function returned {iteration_result}."
-                )
-                current_query = "\n\n".join(
-                    [base_query, " ".join(iteration_response), "What should I do next?"]
-                )
-                iteration += 1
-                continue
 
-            if response_text.startswith("FINAL_ANSWER:"):
-                final_payload = response_text[len("FINAL_ANSWER:") :].strip()
-                print(f"LLM Response: FINAL_ANSWER: {final_payload} ")
-                if not final_payload:
-                    raise HTTPException(status_code=502, detail="Gemini returned empty flashcard content.")
 
-                try:
-                    flashcards = _parse_flashcards(final_payload, FLASHCARD_COUNT)
-                    print(f"Results: {flashcards} ")
-                except ValueError as exc:
-                    raise HTTPException(status_code=502, detail=str(exc)) from exc
+    model_name = DEFAULT_MODEL
 
-                print("\n=== Agent Execution Complete ===")
-                break
+    response_key = _response_cache_key(model_name, request_text)
+    cached_response = await RESPONSE_CACHE.get(response_key)
+    if cached_response is not None:
+        _log_request(started, "Status: Flashcards served from the response cache.")
+        return Response(content=cached_response, media_type="application/json")
 
-            raise HTTPException(status_code=502, detail="Gemini response missing FUNCTION_CALL or FINAL_ANSWER prefix.")
+    try:
+        client = _get_client(api_key)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
 
-        if flashcards is None:
-            raise HTTPException(status_code=502, detail="Gemini agent did not produce a final answer.")
+    try:
+        flashcards, content_rating, information_hierarchy = await RUN_PIPELINE(client, model_name, request_text)
 
 
         cards = {
@@ -435,29 +826,46 @@ Let's solve this step by step.
             for index, card in enumerate(flashcards, start=1)
         }
 
-        cards_status = "Status: Flashcards generated successfully."
-        steps.append("Flashcards generated successfully.")
-        _log_lines([cards_status])
+        _log_request(started, "Status: Flashcards generated successfully.")
 
         response_payload = GenerateResponse(
             cards=cards,
-            steps=steps,
             content_rating=content_rating,
             information_hierarchy=information_hierarchy,
         )
-        return response_payload
+        body = response_payload.model_dump_json()
+        await RESPONSE_CACHE.set(response_key, body)
+        return Response(content=body, media_type="application/json")
 
     except HTTPException as exc:
         detail = exc.detail if isinstance(exc.detail, str) else str(exc.detail)
         # Surface the failure reason to the log before handing control back to FastAPI.
-        _log_lines([f"Status: Request failed ({exc.status_code}): {detail}"])
+        _log_request(started, f"Status: Request failed ({exc.status_code}): {detail}")
         raise
     except Exception as exc:
         # Unknown exceptions get logged and wrapped so the client receives a consistent error.
-        _log_lines([f"Status: Unexpected error: {exc}"])
+        _log_request(started, f"Status: Unexpected error: {exc}")
         raise HTTPException(status_code=502, detail=f"Gemini request failed: {exc}")
 
 
+@app.post(
+    "/generate/stream",
+    responses={502: {"model": ErrorResponse}},
+)
+async def generate_stream(request: GenerateRequest) -> StreamingResponse:
+    """Server-sent-events variant of /generate for the combined pipeline."""
+    request_text = request.page_context.text.strip()
+    try:
+        client = _get_client(api_key)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=f"Failed to initialize Gemini client: {exc}") from exc
+
+    return StreamingResponse(
+        _stream_study_pack(client, DEFAULT_MODEL, request_text),
+        media_type="text/event-stream",
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestCoalescer:
+    """Share one in-flight call between concurrent requests that use the same key.
+
+    The first caller for a key starts the call; callers that arrive while it is
+    still running await the same task instead of issuing a duplicate request.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, asyncio.Future[Any]] = {}
+
+    async def submit(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield the shared task so one cancelled caller does not cancel it for the others.
+        return await asyncio.shield(task)
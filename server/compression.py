@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip responses except for the given paths.
+
+    Starlette's gzip writer does not flush between body chunks, so streamed
+    responses such as server-sent events would be held back until they finish.
+    """
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = 500, compresslevel: int = 9, exclude_paths: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
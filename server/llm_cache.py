@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "gemini-studybuddy"
+
+
+def cache_key(model: str, prompt: str, config: str = "") -> str:
+    """Return a stable SHA-256 key for a (model, prompt, config fingerprint) triple."""
+    payload = json.dumps({"model": model, "prompt": prompt, "config": config}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """In-process LRU cache of response text with an optional on-disk backend.
+
+    Entries expire after `ttl` seconds. When `cache_dir` is set, responses are
+    also written to `<cache_dir>/<key>.txt` so they survive restarts.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0, cache_dir: Path | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+
+        if self.cache_dir is None:
+            return None
+
+        value = await run_in_threadpool(self._read_file, key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        if self.cache_dir is not None:
+            await run_in_threadpool(self._write_file, key, value)
+
+    def _remember(self, key: str, value: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _read_file(self, key: str) -> str | None:
+        path = self.cache_dir / f"{key}.txt"
+        try:
+            if path.stat().st_mtime + self.ttl < time.time():
+                return None
+            return path.read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def _write_file(self, key: str, value: str) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / f"{key}.txt").write_text(value, encoding="utf-8")
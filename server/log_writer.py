@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import TextIO
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """Append log text through one long-lived file handle owned by a background task.
+
+    `put` only enqueues text. The writer task drains up to `max_batch` entries,
+    waiting at most `max_delay` seconds for stragglers, and writes each batch in a
+    single call. Call `start` and `aclose` from the event loop, e.g. in the app lifespan.
+    A failed batch is logged and dropped; if the task itself dies, `put` falls back
+    to writing straight through.
+    """
+
+    def __init__(self, path: Path, max_batch: int = 16, max_delay: float = 0.05) -> None:
+        self.path = path
+        # Created once up front so neither start() nor the write-through path has to stat it again.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[str | None] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._handle: TextIO | None = None
+
+    async def start(self) -> None:
+        self._handle = self.path.open("a", encoding="utf-8")
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_done)
+
+    def put(self, text: str) -> None:
+        if self._queue is None:
+            # Not started (e.g. used outside the app lifespan): write straight through.
+            with self.path.open("a", encoding="utf-8") as log_file:
+                log_file.write(text)
+            return
+        self._queue.put_nowait(text)
+
+    async def aclose(self) -> None:
+        if self._task is None:
+            return
+        if self._queue is not None:
+            # The sentinel lets the writer flush everything queued ahead of it.
+            self._queue.put_nowait(None)
+            await asyncio.wait((self._task,))
+        self._handle.close()
+        self._queue = self._task = self._handle = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            batch: list[str] = []
+            if entry is None:
+                stopping = True
+            else:
+                batch.append(entry)
+            deadline = loop.time() + self.max_delay
+            while not stopping and len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                else:
+                    batch.append(entry)
+            if batch:
+                try:
+                    await run_in_threadpool(self._write, "".join(batch))
+                except OSError:
+                    logger.exception("Could not write %d log entries to %s", len(batch), self.path)
+
+    def _on_done(self, task: asyncio.Task[None]) -> None:
+        # Stop queueing into a queue nobody drains; put() writes through from here on.
+        self._queue = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Log writer for %s stopped", self.path, exc_info=task.exception())
+
+    def _write(self, text: str) -> None:
+        self._handle.write(text)
+        self._handle.flush()
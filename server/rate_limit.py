@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Cap concurrent upstream calls and smooth their start rate with a token bucket.
+
+    Use as `async with limiter:`. A caller first waits for one of `max_concurrency`
+    slots, then for a token; tokens refill at `rate` per `per` seconds, up to
+    `max(rate, 1)` so a sub-1 rate still yields whole tokens.
+    """
+
+    def __init__(self, max_concurrency: int = 16, rate: float = 60, per: float = 60.0) -> None:
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        if rate <= 0 or per <= 0:
+            raise ValueError(f"rate and per must be positive, got rate={rate} per={per}")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._capacity = max(float(rate), 1.0)
+        self._tokens = self._capacity
+        self._fill_rate = rate / per
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self._semaphore.release()
+
+    async def _take_token(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in arrival order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._fill_rate)
@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# The server modules import each other as top-level modules, as they do under `uvicorn app:app`.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# app.py reads the key at import; tests never reach Gemini.
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
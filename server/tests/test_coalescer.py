@@ -0,0 +1,32 @@
+import asyncio
+
+from coalescer import RequestCoalescer
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    calls = 0
+
+    async def scenario():
+        nonlocal calls
+        coalescer = RequestCoalescer()
+        release = asyncio.Event()
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "reply"
+
+        first = asyncio.create_task(coalescer.submit("key", call))
+        second = asyncio.create_task(coalescer.submit("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await second == "reply"
+        assert first.cancelled()
+        assert coalescer._inflight == {}
+
+    asyncio.run(scenario())
+    assert calls == 1
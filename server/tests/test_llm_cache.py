@@ -0,0 +1,48 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import llm_cache
+from llm_cache import LLMCache
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+
+    async def scenario():
+        cache = LLMCache(ttl=10.0)
+        await cache.set("key", "reply")
+        now[0] += 9.0
+        assert await cache.get("key") == "reply"
+        now[0] += 2.0
+        assert await cache.get("key") is None
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def scenario():
+        cache = LLMCache(maxsize=2)
+        await cache.set("a", "1")
+        await cache.set("b", "2")
+        # Reading "a" makes "b" the least recently used entry.
+        assert await cache.get("a") == "1"
+        await cache.set("c", "3")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "1"
+        assert await cache.get("c") == "3"
+
+    asyncio.run(scenario())
+
+
+def test_stale_files_on_disk_are_ignored(tmp_path):
+    async def scenario():
+        await LLMCache(ttl=60.0, cache_dir=tmp_path).set("key", "reply")
+        assert await LLMCache(ttl=60.0, cache_dir=tmp_path).get("key") == "reply"
+        stale = time.time() - 120.0
+        os.utime(tmp_path / "key.txt", (stale, stale))
+        assert await LLMCache(ttl=60.0, cache_dir=tmp_path).get("key") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Drive the limiter from a fake clock; sleeping advances it and records the delay."""
+    now = [0.0]
+    sleeps: list[float] = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        now[0] += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", fake_sleep)
+    return sleeps
+
+
+def test_waits_for_the_next_token_once_the_bucket_is_empty(clock):
+    async def scenario():
+        limiter = RateLimiter(max_concurrency=4, rate=2, per=1.0)
+        for _ in range(3):
+            async with limiter:
+                pass
+
+    asyncio.run(scenario())
+    # Two tokens are available up front; the third refills at 2 per second.
+    assert clock == [pytest.approx(0.5)]
+
+
+def test_waiters_are_served_in_arrival_order(clock):
+    order: list[int] = []
+
+    async def scenario():
+        limiter = RateLimiter(max_concurrency=2, rate=1, per=1.0)
+
+        async def caller(index):
+            async with limiter:
+                order.append(index)
+
+        await asyncio.gather(*(caller(index) for index in range(5)))
+
+    asyncio.run(scenario())
+    assert order == [0, 1, 2, 3, 4]
+    assert clock == [pytest.approx(1.0)] * 4
+
+
+def test_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        RateLimiter(max_concurrency=0)
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from app import _scan_cards
+
+CARDS = [{"front": "What is [ATP]?", "back": "The cell's {energy} currency."}, {"front": "Q2", "back": "A2"}]
+REPLY = json.dumps({"content_rating": 8, "information_hierarchy": "Cells", "cards": CARDS})
+
+
+def _feed(chunks):
+    """Scan the growing buffer after every chunk, as _stream_study_pack does."""
+    buffer, pos, seen = "", 0, []
+    for chunk in chunks:
+        buffer += chunk
+        items, pos = _scan_cards(buffer, pos)
+        seen.append(items)
+    return seen
+
+
+def test_card_split_across_chunks_is_emitted_once_complete():
+    split = REPLY.index('"Q2"')
+    seen = _feed([REPLY[:split], REPLY[split:]])
+    assert seen == [[CARDS[0]], [CARDS[1]]]
+
+
+def test_nothing_is_emitted_before_the_cards_array():
+    split = REPLY.index('"cards"') + 3
+    assert _feed([REPLY[:split]]) == [[]]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 16])
+def test_every_card_is_emitted_exactly_once(size):
+    chunks = [REPLY[start:start + size] for start in range(0, len(REPLY), size)]
+    assert [card for items in _feed(chunks) for card in items] == CARDS